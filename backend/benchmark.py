@@ -0,0 +1,152 @@
+"""
+Benchmark /search in-process against synthetic CDx tables.
+
+Tables are generated from the value distributions in Table_Data.csv, so
+column cardinalities and term selectivities look like the real data at
+1k, 100k or 1M rows. Every size runs the same fixed query mix through
+main.search(), once with the result cache disabled and once warm, and
+reports throughput and p50/p99 latency.
+
+    python benchmark.py                      # 1k, 100k and 1M rows
+    python benchmark.py --rows 1000 --iterations 50
+"""
+import argparse
+import inspect
+import json
+import random
+import statistics
+import time
+from datetime import date
+
+import main
+from dataset import COLUMNS, DatasetSnapshot, parse_table
+
+# Fixed query mix: common biomarkers, combined filters, short (unindexed)
+# terms, date ranges and paged listings
+QUERY_MIX = [
+    {"limit": 100},
+    {"biomarker": "EGFR"},
+    {"biomarker": "HER2"},
+    {"biomarker": "ALK", "indication_sample": "lung"},
+    {"biomarker": "BRAF", "technology_used": "NGS"},
+    {"technology_used": "NGS", "limit": 50},
+    {"drug_trade_name": "osimertinib"},
+    {"drug_manufacturer": "AstraZeneca"},
+    {"diagnostic_name": "FoundationOne"},
+    {"fda_approval_date": "2020"},
+    {"biomarker": "BR"},
+    {"approved_after": date(2018, 1, 1), "approved_before": date(2019, 12, 31), "technology_used": "PCR"},
+]
+
+DEFAULT_SIZES = [1_000, 100_000, 1_000_000]
+
+
+def load_source_rows():
+    with open(main.DATA_PATH, 'rb') as f:
+        return parse_table(f.read().decode('utf-8'))
+
+
+def synthetic_table(source_rows, size, seed=0):
+    """
+    `size` rows drawn from the source table. Each row copies a random source
+    row (keeping realistic co-occurrence of biomarker, drug and indication),
+    makes the diagnostic name unique and picks a random approval date.
+    """
+    rng = random.Random(seed)
+    start = date(1997, 1, 1).toordinal()
+    end = date(2025, 12, 31).toordinal()
+    rows = []
+    for n in range(size):
+        row = dict(rng.choice(source_rows))
+        row['Diagnostic Name (Manufacturer)'] = f"{row['Diagnostic Name (Manufacturer)']} #{n}"
+        row['FDA CDx Approval Date'] = date.fromordinal(rng.randint(start, end)).isoformat()
+        rows.append(row)
+    return rows
+
+
+def search_defaults():
+    """Keyword arguments for calling main.search() directly, outside FastAPI."""
+    defaults = {}
+    for name, param in inspect.signature(main.search).parameters.items():
+        defaults[name] = getattr(param.default, "default", param.default)
+    return defaults
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_mix(iterations):
+    defaults = search_defaults()
+    latencies = []
+    response_bytes = 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for query in QUERY_MIX:
+            t0 = time.perf_counter()
+            response = main.search(**dict(defaults, **query))
+            latencies.append(time.perf_counter() - t0)
+            response_bytes += len(response.body)
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(latencies),
+        "qps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 3),
+        "mb_out": round(response_bytes / 1e6, 2),
+    }
+
+
+def benchmark(size, iterations, source_rows, seed=0):
+    rows = synthetic_table(source_rows, size, seed)
+    t0 = time.perf_counter()
+    snapshot = DatasetSnapshot(rows, f"synthetic-{size}-{seed}", "synthetic")
+    build = time.perf_counter() - t0
+    main.store.install(snapshot)
+
+    cache_size = main.query_cache.max_entries
+    report = {"rows": size, "build_s": round(build, 3)}
+    try:
+        main.query_cache.max_entries = 0
+        main.query_cache.clear()
+        report["uncached"] = run_mix(iterations)
+        main.query_cache.max_entries = cache_size
+        run_mix(1)  # fill the cache
+        report["cached"] = run_mix(iterations)
+    finally:
+        main.query_cache.max_entries = cache_size
+        main.query_cache.clear()
+    return report
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_SIZES, help="table sizes to benchmark")
+    parser.add_argument("--iterations", type=int, default=5, help="passes over the query mix per mode")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the reports as JSON")
+    args = parser.parse_args()
+
+    source_rows = load_source_rows()
+    missing = [col for col in COLUMNS if col not in source_rows[0]]
+    if missing:
+        parser.error(f"source table is missing columns: {missing}")
+
+    reports = []
+    for size in args.rows:
+        report = benchmark(size, args.iterations, source_rows, args.seed)
+        reports.append(report)
+        if not args.json:
+            print(f"{size:>9,} rows  build {report['build_s']:.3f}s")
+            for mode in ("uncached", "cached"):
+                r = report[mode]
+                print(f"    {mode:<9} {r['qps']:>10.1f} req/s  p50 {r['p50_ms']:>9.3f} ms  "
+                      f"p99 {r['p99_ms']:>9.3f} ms  {r['mb_out']:>8.2f} MB out")
+    if args.json:
+        print(json.dumps(reports, indent=2))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,304 @@
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional, Sequence
+
+import httpx
+
+from responses import row_fragments
+from search_index import TableIndex
+
+# Columns returned for table rendering (in order)
+COLUMNS = [
+    'Diagnostic Name (Manufacturer)',
+    'Technology Used',
+    'Indication - Sample Type',
+    'Drug Trade Name  (Generic)',
+    'Drug Manufacturer',
+    'Biomarker(s)',
+    'Biomarker(s) (Details)',
+    'FDA CDx Approval Date',
+    'PMA/510(k)/513(f)(2)/HDE',
+    'NDA/BLA Number'
+]
+
+
+def parse_table(text):
+    """Parse CSV text into a list of row dicts with normalized column names."""
+    reader = csv.DictReader(io.StringIO(text))
+    table = []
+    for row in reader:
+        new_row = {}
+        for k, v in row.items():
+            # Normalize column names (strip BOM and whitespace)
+            key = k.replace('\ufeff', '').strip() if k else k
+            new_row[key] = v
+        table.append(new_row)
+    return table
+
+
+def content_version(data):
+    """Short content hash used as the snapshot version."""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+class DatasetSnapshot:
+    """
+    Immutable, parsed view of one version of the table.
+    A new snapshot is built whenever the source content changes; readers keep
+    whatever snapshot they grabbed, so a refresh never mutates data in use.
+    """
+
+    def __init__(self, rows, version, source, index=None, fragments=None):
+        self.rows: Sequence[Dict[str, str]] = rows
+        self.version: str = version
+        self.source: str = source
+        self.index = index if index is not None else TableIndex(rows)
+        # JSON bytes of each row, spliced into responses without re-encoding
+        self.fragments: Sequence[bytes] = fragments if fragments is not None else row_fragments(rows)
+        # Encoded (and possibly compressed) unfiltered listing, by content coding
+        self.listing_cache: Dict[Optional[str], bytes] = {}
+        self.loaded_at = time.time()
+        self.load_seconds = 0.0
+
+    @classmethod
+    def from_text(cls, text, source):
+        start = time.perf_counter()
+        snapshot = cls(parse_table(text), content_version(text), source)
+        snapshot.load_seconds = time.perf_counter() - start
+        return snapshot
+
+    def age(self):
+        return time.time() - self.loaded_at
+
+
+class DatasetStore:
+    """
+    Holds the current snapshot and keeps it fresh in the background.
+    Requests only ever read the in-memory snapshot. The refresher revalidates
+    against the remote URL with conditional GETs on a shared pooled client,
+    coalesces concurrent reloads into one in-flight fetch, and falls back to
+    the local file if nothing has been loaded yet and the fetch fails.
+    """
+
+    def __init__(self, url, local_path, refresh_interval=300.0, timeout=10.0, client=None,
+                 snapshot_path=None):
+        self.url = url
+        self.local_path = local_path
+        self.snapshot_path = snapshot_path
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        self.last_checked: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.fetches = 0
+        self._snapshot: Optional[DatasetSnapshot] = None
+        self._lock = threading.Lock()
+        self._client: Optional[httpx.AsyncClient] = client
+        self._owns_client = client is None
+        self._inflight: Optional[asyncio.Future] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    def get_snapshot(self):
+        """Return the current snapshot, loading the local file if nothing is loaded yet."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self.load_local()
+                snapshot = self._snapshot
+        return snapshot
+
+    def load_local(self):
+        if not self.local_path:
+            self.last_error = "Data file not found"
+            return None
+        if self.snapshot_path:
+            # Imported here: snapshot_file builds on DatasetSnapshot
+            from snapshot_file import load_or_build
+            try:
+                start = time.perf_counter()
+                snapshot = load_or_build(self.local_path, self.snapshot_path)
+                snapshot.load_seconds = time.perf_counter() - start
+                self._load_validators(snapshot.version)
+                return self.install(snapshot)
+            except FileNotFoundError:
+                self.last_error = f"Data file not found at {self.local_path}"
+                return None
+            except Exception as e:
+                # e.g. a read-only filesystem; parse the CSV directly instead
+                print(f"Error loading compiled snapshot: {str(e)}")
+        try:
+            with open(self.local_path, 'rb') as f:
+                text = f.read().decode('utf-8')
+        except FileNotFoundError:
+            self.last_error = f"Data file not found at {self.local_path}"
+            return None
+        except Exception as e:
+            self.last_error = f"Error loading data: {str(e)}"
+            return None
+        return self.install(DatasetSnapshot.from_text(text, "local"))
+
+    def _validators_path(self):
+        return f"{self.snapshot_path}.validators" if self.snapshot_path else None
+
+    def _load_validators(self, version):
+        """
+        Restore the upstream ETag/Last-Modified saved for this content, so the
+        first revalidation after a cold start can be a conditional GET.
+        """
+        path = self._validators_path()
+        try:
+            with open(path, encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        if saved.get("version") == version:
+            self.etag = saved.get("etag")
+            self.last_modified = saved.get("last_modified")
+
+    def _save_validators(self, version):
+        path = self._validators_path()
+        if not path:
+            return
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({"version": version, "etag": self.etag,
+                           "last_modified": self.last_modified}, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            # e.g. a read-only filesystem; the next cold start just downloads
+            print(f"Error saving upstream validators: {str(e)}")
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 5.0)),
+                limits=httpx.Limits(max_connections=4, max_keepalive_connections=2),
+                follow_redirects=True,
+            )
+        return self._client
+
+    async def refresh(self):
+        """
+        Revalidate the snapshot against the remote URL. Concurrent callers
+        share a single in-flight fetch and all receive its result.
+        """
+        return await asyncio.shield(self._begin_fetch())
+
+    def _begin_fetch(self):
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._fetch())
+            self._inflight.add_done_callback(self._clear_inflight)
+        return self._inflight
+
+    def _clear_inflight(self, future):
+        if self._inflight is future:
+            self._inflight = None
+
+    async def _fetch(self):
+        current = self._snapshot
+        headers = {}
+        if current is not None:
+            if self.etag:
+                headers['If-None-Match'] = self.etag
+            if self.last_modified:
+                headers['If-Modified-Since'] = self.last_modified
+        try:
+            self.fetches += 1
+            response = await self._get_client().get(self.url, headers=headers)
+            self.last_checked = time.time()
+            if response.status_code == 304:
+                return current
+            if response.status_code != 200:
+                raise RuntimeError(f"unexpected status {response.status_code}")
+            text = response.content.decode('utf-8')
+            # Validators only describe what is actually being served, so they
+            # are kept until the new content has been installed
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            if current is not None and current.version == content_version(text):
+                # Same content as the local copy, nothing to rebuild
+                self.etag, self.last_modified = etag, last_modified
+                if current.source == "local":
+                    await asyncio.to_thread(self._save_validators, current.version)
+                return current
+            # Parse and index off the event loop
+            snapshot = await asyncio.to_thread(DatasetSnapshot.from_text, text, "github")
+            if not snapshot.rows:
+                raise RuntimeError("remote table is empty")
+            self.install(snapshot)
+            self.etag, self.last_modified = etag, last_modified
+            return snapshot
+        except Exception as e:
+            # Keep serving the stale snapshot; only fall back when there is none
+            print(f"Error fetching from GitHub: {str(e)}")
+            error = str(e) or type(e).__name__
+            if self._snapshot is None:
+                await asyncio.to_thread(self.get_snapshot)
+            self.last_error = error
+            return self._snapshot
+
+    def install(self, snapshot):
+        self._snapshot = snapshot
+        self.last_error = None
+        return snapshot
+
+    async def start(self):
+        """
+        Warm the snapshot from the local (compiled) copy and revalidate it in
+        the background; the network is only awaited when nothing local loads.
+        """
+        await asyncio.to_thread(self.get_snapshot)
+        if self._snapshot is None:
+            await self.refresh()
+        else:
+            # Joined by any refresh() issued while it is still in flight
+            self._begin_fetch()
+        if self._task is None and self.refresh_interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._inflight is not None:
+            self._inflight.cancel()
+        if self._client is not None and self._owns_client:
+            await self._client.aclose()
+            self._client = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self.refresh()
+
+    def info(self):
+        snapshot = self._snapshot
+        return {
+            "version": snapshot.version if snapshot else None,
+            "source": snapshot.source if snapshot else None,
+            "rows": len(snapshot.rows) if snapshot else 0,
+            "age_seconds": round(snapshot.age(), 3) if snapshot else None,
+            "last_checked": self.last_checked,
+            "refresh_interval": self.refresh_interval,
+            "refreshing": self._inflight is not None,
+            "last_error": self.last_error,
+        }
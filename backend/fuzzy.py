@@ -0,0 +1,135 @@
+import re
+from collections import defaultdict
+from typing import Dict, List
+
+# Gene/biomarker aliases clinicians use interchangeably, in token form
+# (lowercase, hyphens and slashes removed)
+SYNONYMS = [
+    {"her2", "erbb2", "neu", "her2neu"},
+    {"egfr", "her1", "erbb1"},
+    {"pdl1", "cd274", "b7h1"},
+    {"msih", "msihigh"},
+    {"alk", "cd246"},
+    {"kit", "cd117"},
+    {"flt3", "cd135"},
+    {"met", "cmet"},
+    {"ntrk", "trk"},
+]
+
+MAX_EDIT_DISTANCE = 2
+
+_JOINED = re.compile(r"(?<=[a-z0-9])[-/](?=[a-z0-9])")
+_SPLIT = re.compile(r"[^a-z0-9]+")
+
+
+def query_tokens(text):
+    """Tokens of a search term; "HER-2" and "HER2/neu" become "her2" and "her2neu"."""
+    return [t for t in _SPLIT.split(_JOINED.sub('', text.lower())) if t]
+
+
+def value_tokens(text):
+    """Tokens of a stored value: the joined forms plus their hyphen/slash separated parts."""
+    tokens = set(query_tokens(text))
+    tokens.update(t for t in _SPLIT.split(text.lower()) if t)
+    return tokens
+
+
+def max_distance(token):
+    # Short gene symbols differ by one character (HER1/HER2), so only
+    # longer tokens get typo tolerance
+    if len(token) <= 4:
+        return 0
+    if len(token) <= 7:
+        return 1
+    return MAX_EDIT_DISTANCE
+
+
+def deletes(token, distance):
+    """All strings reachable from `token` by removing up to `distance` characters."""
+    result = {token}
+    frontier = {token}
+    for _ in range(distance):
+        frontier = {t[:i] + t[i + 1:] for t in frontier for i in range(len(t))}
+        result |= frontier
+    return result
+
+
+def edit_distance(a, b, limit):
+    """Optimal string alignment distance, or limit + 1 once it is known to exceed `limit`."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (previous2 is not None and i > 1 and j > 1
+                    and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class FuzzyIndex:
+    """
+    Symmetric-delete (SymSpell-style) index over the distinct tokens of one
+    column. Expanding a query token only touches its delete variants, so its
+    cost depends on the vocabulary neighbourhood of the token, not on the
+    number of rows.
+    """
+
+    def __init__(self, values):
+        postings = defaultdict(set)
+        tokenized: Dict[str, frozenset] = {}
+        for row_id, value in enumerate(values):
+            tokens = tokenized.get(value)
+            if tokens is None:
+                tokens = tokenized[value] = frozenset(value_tokens(value or ''))
+            for token in tokens:
+                postings[token].add(row_id)
+        self.values = values
+        self.tokenized = tokenized
+        self.postings: Dict[str, List[int]] = {t: sorted(ids) for t, ids in postings.items()}
+        self.deletes: Dict[str, List[str]] = defaultdict(list)
+        for token in self.postings:
+            for variant in deletes(token, max_distance(token)):
+                self.deletes[variant].append(token)
+        self.synonyms: Dict[str, set] = {}
+        for group in SYNONYMS:
+            for token in group:
+                self.synonyms[token] = group
+
+    def expand(self, token):
+        """Indexed tokens within edit distance of `token` (plus their synonyms) -> distance."""
+        limit = max_distance(token)
+        found: Dict[str, int] = {}
+        for variant in deletes(token, limit):
+            for candidate in self.deletes.get(variant, ()):
+                if candidate not in found:
+                    distance = edit_distance(token, candidate, limit)
+                    if distance <= limit:
+                        found[candidate] = distance
+        for source, distance in list(found.items()) + [(token, 0)]:
+            for synonym in self.synonyms.get(source, ()):
+                if synonym in self.postings and found.get(synonym, distance + 1) > distance:
+                    found[synonym] = distance
+        return found
+
+    def plan(self, term):
+        """Expansion (indexed token -> distance) of each token of `term`."""
+        return [self.expand(token) for token in query_tokens(term)]
+
+    def row_cost(self, row_id, plan):
+        """Summed distance of the row's closest token for each planned token, or None."""
+        tokens = self.tokenized[self.values[row_id]]
+        total = 0
+        for matches in plan:
+            best = min((matches[t] for t in tokens if t in matches), default=None)
+            if best is None:
+                return None
+            total += best
+        return total
@@ -1,14 +1,28 @@
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, Header, HTTPException, Query, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Optional
-import csv
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from contextlib import asynccontextmanager
+from datetime import date
+from itertools import islice
+from typing import List, Optional
 import os
-import sys
-import re
-import requests
-import io
+from dataset import COLUMNS, DatasetStore
+from metrics import Metrics, StageTimer
+from responses import compress, dumps, encoding_headers, json_array, json_object, negotiate_encoding
+from query_cache import QueryCache, etag_matches, make_etag, normalize_query
+from search_index import DATE_RANGE_PARAMS, FUZZY_COLUMNS, SEARCH_COLUMNS
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    # Warm the snapshot locally before the app starts accepting requests;
+    # the upstream revalidation continues in the background
+    await store.start()
+    yield
+    await store.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 # Allow frontend to access backend - more specific origins
 app.add_middleware(
@@ -45,75 +59,147 @@ for path in possible_data_paths:
         DATA_PATH = path
         break
 
+# Seconds between background revalidations of the GitHub copy (0 disables)
+DATA_REFRESH_INTERVAL = float(os.environ.get("DATA_REFRESH_INTERVAL", "300"))
+# Timeout in seconds for each GitHub fetch
+DATA_FETCH_TIMEOUT = float(os.environ.get("DATA_FETCH_TIMEOUT", "10"))
+
+# Compiled binary snapshot of the local CSV, memory-mapped and shared by all
+# workers; rebuilt automatically when the CSV changes ("" disables)
+SNAPSHOT_PATH = os.environ.get(
+    "SNAPSHOT_PATH", os.path.splitext(DATA_PATH)[0] + ".cdxsnap" if DATA_PATH else "")
+
+# In-memory snapshot of the table; requests never fetch the data themselves
+store = DatasetStore(GITHUB_DATA_URL, DATA_PATH, refresh_interval=DATA_REFRESH_INTERVAL,
+                     timeout=DATA_FETCH_TIMEOUT, snapshot_path=SNAPSHOT_PATH)
+
+# Positions in the normalized query key of the parameters that support fuzzy=true
+FUZZY_PARAMS = [n for n, column in enumerate(SEARCH_COLUMNS.values()) if column in FUZZY_COLUMNS]
+
+# Request counters and per-stage latency histograms served at /metrics
+metrics = Metrics()
+
+# Upper bound on queries accepted by /search/batch
+MAX_BATCH_QUERIES = int(os.environ.get("MAX_BATCH_QUERIES", "500"))
+
+# Matching row ids for repeated queries, dropped whenever the dataset version changes
+query_cache = QueryCache(
+    max_entries=int(os.environ.get("QUERY_CACHE_SIZE", "256")),
+    ttl=float(os.environ.get("QUERY_CACHE_TTL", "300")),
+)
+
 @app.get("/")
 async def root():
     paths_checked = "\n".join(possible_data_paths)
     data_exists = DATA_PATH is not None
     return {
         "message": "CDx Backend API is running", 
-        "endpoints": ["/search"],
+        "endpoints": ["/search", "/search/batch", "/facets", "/dataset", "/cache", "/metrics"],
         "data_source": "GitHub",
         "github_url": GITHUB_DATA_URL,
         "data_path_exists": data_exists,
         "data_path": DATA_PATH if data_exists else None,
         "paths_checked": paths_checked,
         "cwd": os.getcwd(),
-        "dir_contents": str(os.listdir('.' if os.getcwd() else '/'))
+        "dir_contents": str(os.listdir('.' if os.getcwd() else '/')),
+        "dataset": store.info()
     }
 
-# Helper to load table data from GitHub
-def load_table():
-    try:
-        # First try to fetch from GitHub
-        response = requests.get(GITHUB_DATA_URL)
-        if response.status_code == 200:
-            # Parse the CSV from the response content
-            csv_content = io.StringIO(response.text)
-            reader = csv.DictReader(csv_content)
-            table = list(reader)
-            if table:
-                # Normalize column names (strip BOM and whitespace)
-                normalized_table = []
-                for row in table:
-                    new_row = {}
-                    for k, v in row.items():
-                        key = k.replace('\ufeff', '').strip()
-                        new_row[key] = v
-                    normalized_table.append(new_row)
-                return normalized_table
-            return table
-        else:
-            # Fallback to local file if GitHub fetch fails
-            return load_local_table()
-    except Exception as e:
-        # Fallback to local file if GitHub fetch fails
-        print(f"Error fetching from GitHub: {str(e)}")
-        return load_local_table()
-
-# Helper to load table data from local file as fallback
-def load_local_table():
-    if not DATA_PATH:
-        return {"error": f"Data file not found. Checked paths: {possible_data_paths}"}
-    
-    try:
-        with open(DATA_PATH, newline='', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            table = list(reader)
-            if table:
-                # Normalize column names (strip BOM and whitespace)
-                normalized_table = []
-                for row in table:
-                    new_row = {}
-                    for k, v in row.items():
-                        key = k.replace('\ufeff', '').strip()
-                        new_row[key] = v
-                    normalized_table.append(new_row)
-                return normalized_table
-            return table
-    except FileNotFoundError:
-        return {"error": f"Data file not found at {DATA_PATH}"}
-    except Exception as e:
-        return {"error": f"Error loading data: {str(e)}"}
+@app.get("/dataset")
+async def dataset_info():
+    """Version and age of the in-memory snapshot currently being served."""
+    return store.info()
+
+@app.get("/cache")
+async def cache_stats():
+    """Hit/miss/eviction counters for the search result cache."""
+    return query_cache.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Prometheus text exposition of request, stage timing, dataset and cache metrics."""
+    snapshot = store.snapshot
+    cache = query_cache.stats()
+    gauges = {
+        "cdx_dataset_rows": ("Rows in the loaded dataset snapshot.", len(snapshot.rows) if snapshot else 0),
+        "cdx_dataset_age_seconds": ("Seconds since the snapshot was loaded.", round(snapshot.age(), 3) if snapshot else 0),
+        "cdx_dataset_load_seconds": ("Time spent parsing and indexing the snapshot.", round(snapshot.load_seconds, 6) if snapshot else 0),
+        "cdx_query_cache_entries": ("Entries in the query result cache.", cache["entries"]),
+        "cdx_query_cache_hits_total": ("Query cache hits.", cache["hits"]),
+        "cdx_query_cache_misses_total": ("Query cache misses.", cache["misses"]),
+        "cdx_query_cache_evictions_total": ("Query cache LRU evictions.", cache["evictions"]),
+        "cdx_query_cache_invalidations_total": ("Query cache flushes caused by a new dataset version.", cache["invalidations"]),
+    }
+    return metrics.render(gauges)
+
+def parse_fields(fields):
+    """Validate a `fields=` projection (repeated and/or comma-separated column names)."""
+    if not fields:
+        return None
+    selected = [name.strip() for value in fields for name in value.split(',') if name.strip()]
+    # Each column once, in the order first requested
+    selected = list(dict.fromkeys(selected))
+    unknown = [name for name in selected if name not in COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {unknown}. Valid fields: {COLUMNS}")
+    return selected or None
+
+def parse_cursor(cursor):
+    if cursor is None:
+        return 0
+    if not cursor.isdigit():
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return int(cursor)
+
+def echoed_terms(terms, key):
+    """Terms as sent, with those normalize_query dropped (e.g. blank) echoed as None."""
+    return {name: value if normalized is not None else None
+            for (name, value), normalized in zip(terms.items(), key)}
+
+def iter_matches(snapshot, key):
+    """Row ids matching a normalized query key (see normalize_query)."""
+    if not any(key):
+        # If no search terms provided, return all rows
+        return iter(range(len(snapshot.rows)))
+    # Row matches if ALL provided search terms match in their respective columns
+    return snapshot.index.iter_search(*query_plan(key))
+
+def cached_matches(snapshot, key):
+    """Tuple of row ids matching a normalized query, via the query cache."""
+    matched = query_cache.get(snapshot.version, key)
+    if matched is None:
+        matched = tuple(iter_matches(snapshot, key))
+        query_cache.put(snapshot.version, key, matched)
+    return matched
+
+def fuzzy_matches(snapshot, key, top_k):
+    """
+    (row ids, match costs, expanded tokens per parameter) for a fuzzy query,
+    best matches first, via the query cache.
+    """
+    cache_key = key + ("fuzzy", top_k)
+    ranked = query_cache.get(snapshot.version, cache_key)
+    if ranked is None:
+        pairs, expanded = snapshot.index.fuzzy_search(*query_plan(key), top_k=top_k)
+        names = {column: name for name, column in SEARCH_COLUMNS.items()}
+        ranked = (
+            tuple(i for i, _ in pairs),
+            tuple(cost for _, cost in pairs),
+            {names[column]: tokens for column, tokens in expanded.items()},
+        )
+        query_cache.put(snapshot.version, cache_key, ranked)
+    return ranked
+
+def query_plan(key):
+    """Split a query key into (column -> term, approved_after, approved_before)."""
+    terms = {column: term for column, term in zip(SEARCH_COLUMNS.values(), key)}
+    after, before = key[len(SEARCH_COLUMNS):]
+    return terms, after, before
+
+def project(row, fields):
+    if fields is None:
+        return row
+    return {name: row.get(name) for name in fields}
 
 @app.get("/search")
 def search(
@@ -125,109 +211,271 @@ def search(
     biomarker: Optional[str] = Query(None),
     biomarker_details: Optional[str] = Query(None),
     fda_approval_date: Optional[str] = Query(None),
+    approved_after: Optional[date] = Query(None),
+    approved_before: Optional[date] = Query(None),
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = Query(None),
+    fields: Optional[List[str]] = Query(None),
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    fuzzy: bool = Query(False),
+    top_k: int = Query(50, ge=1, le=500),
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
 ):
     """
     Search the table by any combination of fields. Case-insensitive, partial match.
     Rule: If a search term matches in its corresponding column, the whole row will be returned.
     All matching rows are returned without deduplication.
+    `approved_after`/`approved_before` restrict the FDA approval date (inclusive).
+    Paging: `limit` caps the rows returned and `next_cursor` is passed back as `cursor`
+    for the next page. `fields` restricts each row to the given columns.
+    `format=ndjson` streams one JSON row per line while the filter is still running.
+    Matching row ids are cached per dataset version, and responses carry an ETag so
+    a repeated query with If-None-Match gets a 304.
+    Stage timings (load, filter, serialize) are returned in a Server-Timing header.
+    `fuzzy=true` tolerates typos and synonyms in `biomarker` and `drug_trade_name`
+    ("HER-2", "osimertnib") and returns the `top_k` best matches, closest first.
+    JSON bodies are assembled from rows pre-serialized at load and compressed
+    with br/gzip per Accept-Encoding.
     """
-    table = load_table()
+    timer = StageTimer()
+    with timer.stage("load"):
+        snapshot = store.get_snapshot()
     
     # Check if there's an error loading the table
-    if isinstance(table, dict) and "error" in table:
-        return table
-        
-    results = []
+    if snapshot is None:
+        return {"error": store.last_error}
+    table = snapshot.rows
+    selected = parse_fields(fields)
+    start = parse_cursor(cursor)
+    stop = start + limit if limit is not None else None
     
-    # Simple function to check if a field matches the search term
-    def matches(field_value, search_term):
-        if not search_term:
-            return True  # Empty search terms match everything in their column
-        if not field_value:
-            return False
-        # Simple case insensitive check
-        return search_term.lower() in field_value.lower()
+    search_terms = {
+        "diagnostic_name": diagnostic_name,
+        "technology_used": technology_used,
+        "indication_sample": indication_sample,
+        "drug_trade_name": drug_trade_name,
+        "drug_manufacturer": drug_manufacturer,
+        "biomarker": biomarker,
+        "biomarker_details": biomarker_details,
+        "fda_approval_date": fda_approval_date,
+        "approved_after": approved_after,
+        "approved_before": approved_before,
+    }
+    key = normalize_query(search_terms)
+    search_terms = echoed_terms(search_terms, key)
+    use_fuzzy = fuzzy and any(key[n] for n in FUZZY_PARAMS)
+    encoding = negotiate_encoding(accept_encoding) if format == "json" else None
+    # Tagged on the echoed terms, not the cache key: search_info returns them as sent
+    etag = make_etag(snapshot.version, tuple(search_terms.values()), start, limit, selected, format,
+                     use_fuzzy and top_k, encoding)
+    headers = {"ETag": etag, **encoding_headers(encoding)}
+    if etag_matches(if_none_match, etag):
+        metrics.record("search", timer)
+        headers["Server-Timing"] = timer.server_timing()
+        return Response(status_code=304, headers=headers)
     
-    # If no search terms provided, return all rows
-    has_search_terms = any([
-        diagnostic_name, technology_used, indication_sample, 
-        drug_trade_name, drug_manufacturer, biomarker,
-        biomarker_details, fda_approval_date
-    ])
+    if format == "ndjson":
+        # Row ids matching this query, shared by every page/projection of it
+        with timer.stage("filter"):
+            if use_fuzzy:
+                matched = fuzzy_matches(snapshot, key, top_k)[0]
+            else:
+                matched = query_cache.get(snapshot.version, key)
+            matches = iter(matched) if matched is not None else iter_matches(snapshot, key)
+        # Headers go out before the body, so Server-Timing stops here; the
+        # streamed rows are timed and counted once the stream has finished
+        headers["X-Dataset-Version"] = snapshot.version
+        headers["Server-Timing"] = timer.server_timing()
+        def stream():
+            returned = 0
+            try:
+                with timer.stage("stream"):
+                    for i in islice(matches, start, stop):
+                        if selected is None:
+                            yield b"".join((snapshot.fragments[i], b"\n"))
+                        else:
+                            yield dumps(project(table[i], selected)) + b"\n"
+                        returned += 1
+            finally:
+                metrics.record("search", timer, matched=returned, returned=returned)
+        return StreamingResponse(stream(), media_type="application/x-ndjson", headers=headers)
     
-    if not has_search_terms:
-        results = table
-    else:
-        # Go through each row
-        for row in table:
-            # Define column names from the CSV
-            diag_name_col = 'Diagnostic Name (Manufacturer)'
-            tech_used_col = 'Technology Used'
-            indication_col = 'Indication - Sample Type'
-            drug_trade_col = 'Drug Trade Name  (Generic)'
-            drug_manufacturer_col = 'Drug Manufacturer'
-            biomarker_col = 'Biomarker(s)'
-            biomarker_details_col = 'Biomarker(s) (Details)'
-            approval_date_col = 'FDA CDx Approval Date'
-            
-            # Skip rows missing expected columns
-            if not all(key in row for key in [
-                diag_name_col, tech_used_col, indication_col, 
-                drug_trade_col, drug_manufacturer_col, biomarker_col, 
-                biomarker_details_col, approval_date_col
-            ]):
-                continue
-                
-            # Check each term against its corresponding column
-            diag_match = matches(row.get(diag_name_col, ''), diagnostic_name)
-            tech_match = matches(row.get(tech_used_col, ''), technology_used)
-            indication_match = matches(row.get(indication_col, ''), indication_sample)
-            drug_trade_match = matches(row.get(drug_trade_col, ''), drug_trade_name)
-            drug_manufacturer_match = matches(row.get(drug_manufacturer_col, ''), drug_manufacturer)
-            biomarker_match = matches(row.get(biomarker_col, ''), biomarker)
-            biomarker_details_match = matches(row.get(biomarker_details_col, ''), biomarker_details)
-            approval_date_match = matches(row.get(approval_date_col, ''), fda_approval_date)
+    with timer.stage("filter"):
+        if use_fuzzy:
+            matched, costs, expanded = fuzzy_matches(snapshot, key, top_k)
+        else:
+            matched = cached_matches(snapshot, key)
+        page = matched[start:stop]
+        next_cursor = str(stop) if stop is not None and stop < len(matched) else None
+    
+    with timer.stage("serialize"):
+        # The unfiltered listing is identical for every request on a snapshot
+        listing = (all(value is None for value in search_terms.values()) and start == 0
+                   and limit is None and selected is None)
+        body = snapshot.listing_cache.get(encoding) if listing else None
+        if body is None:
+            # Return results with diagnostic info
+            search_info = {
+                "search_terms": search_terms,
+                "matched_rows": len(matched),
+                "returned_rows": len(page),
+                "total_rows": len(table),
+                "search_rule": "Match search terms in their corresponding columns",
+                "dataset_version": snapshot.version
+            }
+            if use_fuzzy:
+                search_info["fuzzy"] = {
+                    "top_k": top_k,
+                    "expanded_terms": expanded,
+                    "match_costs": list(costs[start:stop]),
+                }
             
-            # Row matches if ALL provided search terms match in their respective columns
-            if (diag_match and tech_match and indication_match and 
-                drug_trade_match and drug_manufacturer_match and biomarker_match and 
-                biomarker_details_match and approval_date_match):
-                results.append(row)
+            # Rows are spliced in from fragments serialized when the snapshot loaded
+            if selected is None:
+                results = json_array(snapshot.fragments[i] for i in page)
+            else:
+                results = json_array(dumps(project(table[i], selected)) for i in page)
+            body = compress(json_object([
+                ("columns", dumps(selected or COLUMNS)),
+                ("results", results),
+                ("total_matches", dumps(len(matched))),
+                ("next_cursor", dumps(next_cursor)),
+                ("search_info", dumps(jsonable_encoder(search_info))),
+            ]), encoding)
+            if listing:
+                snapshot.listing_cache[encoding] = body
+        response = Response(body, media_type="application/json", headers=headers)
     
-    # Define columns for table rendering (in order)
-    columns = [
-        'Diagnostic Name (Manufacturer)',
-        'Technology Used',
-        'Indication - Sample Type',
-        'Drug Trade Name  (Generic)',
-        'Drug Manufacturer',
-        'Biomarker(s)',
-        'Biomarker(s) (Details)',
-        'FDA CDx Approval Date',
-        'PMA/510(k)/513(f)(2)/HDE',
-        'NDA/BLA Number'
-    ]
+    metrics.record("search", timer, matched=len(matched), returned=len(page))
+    response.headers["Server-Timing"] = timer.server_timing()
+    return response
+
+class SearchQuery(BaseModel):
+    diagnostic_name: Optional[str] = None
+    technology_used: Optional[str] = None
+    indication_sample: Optional[str] = None
+    drug_trade_name: Optional[str] = None
+    drug_manufacturer: Optional[str] = None
+    biomarker: Optional[str] = None
+    biomarker_details: Optional[str] = None
+    fda_approval_date: Optional[str] = None
+    approved_after: Optional[date] = None
+    approved_before: Optional[date] = None
+
+    def terms(self):
+        return {name: getattr(self, name) for name in list(SEARCH_COLUMNS) + list(DATE_RANGE_PARAMS)}
+
+class BatchSearchRequest(BaseModel):
+    queries: List[SearchQuery]
+    fields: Optional[List[str]] = None
+
+@app.post("/search/batch")
+def search_batch(batch: BatchSearchRequest, accept_encoding: Optional[str] = Header(None)):
+    """
+    Run many searches (same fields and matching rule as /search) in one call.
+    Each result lists the ids of its matching rows; the rows themselves are
+    returned once in `rows`, keyed by id, however many queries matched them.
+    """
+    if len(batch.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUERIES} queries per batch")
+    timer = StageTimer()
+    with timer.stage("load"):
+        snapshot = store.get_snapshot()
+    if snapshot is None:
+        return {"error": store.last_error}
+    table = snapshot.rows
+    selected = parse_fields(batch.fields)
     
-    # Return results with diagnostic info
-    search_info = {
-        "search_terms": {
-            "diagnostic_name": diagnostic_name,
-            "technology_used": technology_used,
-            "indication_sample": indication_sample,
-            "drug_trade_name": drug_trade_name,
-            "drug_manufacturer": drug_manufacturer,
-            "biomarker": biomarker,
-            "biomarker_details": biomarker_details,
-            "fda_approval_date": fda_approval_date
-        },
-        "matched_rows": len(results),
-        "total_rows": len(table) if isinstance(table, list) else 0,
-        "search_rule": "Match search terms in their corresponding columns"
-    }
+    with timer.stage("filter"):
+        keys = [normalize_query(query.terms()) for query in batch.queries]
+        found = {}
+        pending = []
+        for key in dict.fromkeys(keys):
+            matched = query_cache.get(snapshot.version, key)
+            if matched is not None:
+                found[key] = matched
+            elif not any(key):
+                found[key] = tuple(range(len(table)))
+            else:
+                pending.append(key)
+        # Uncached queries are evaluated together so unindexed ones share one scan
+        for key, ids in zip(pending, snapshot.index.search_many([query_plan(key) for key in pending])):
+            found[key] = tuple(ids)
+            query_cache.put(snapshot.version, key, found[key])
+    
+    with timer.stage("serialize"):
+        results = []
+        row_ids = set()
+        for query, key in zip(batch.queries, keys):
+            matched = found[key]
+            row_ids.update(matched)
+            results.append({
+                "query": echoed_terms(query.terms(), key),
+                "row_ids": list(matched),
+                "total_matches": len(matched),
+            })
+        
+        if selected is None:
+            rows = json_object((str(i), snapshot.fragments[i]) for i in sorted(row_ids))
+        else:
+            rows = json_object((str(i), dumps(project(table[i], selected))) for i in sorted(row_ids))
+        encoding = negotiate_encoding(accept_encoding)
+        body = compress(json_object([
+            ("columns", dumps(selected or COLUMNS)),
+            ("rows", rows),
+            ("results", dumps(jsonable_encoder(results))),
+            ("total_queries", dumps(len(results))),
+            ("unique_rows", dumps(len(row_ids))),
+            ("dataset_version", dumps(snapshot.version)),
+        ]), encoding)
+        response = Response(body, media_type="application/json", headers=encoding_headers(encoding))
     
+    metrics.record("search_batch", timer, matched=sum(len(r["row_ids"]) for r in results), returned=len(row_ids))
+    response.headers["Server-Timing"] = timer.server_timing()
+    return response
+
+@app.get("/facets")
+def facets(
+    diagnostic_name: Optional[str] = Query(None),
+    technology_used: Optional[str] = Query(None),
+    indication_sample: Optional[str] = Query(None),
+    drug_trade_name: Optional[str] = Query(None),
+    drug_manufacturer: Optional[str] = Query(None),
+    biomarker: Optional[str] = Query(None),
+    biomarker_details: Optional[str] = Query(None),
+    fda_approval_date: Optional[str] = Query(None),
+    approved_after: Optional[date] = Query(None),
+    approved_before: Optional[date] = Query(None),
+):
+    """
+    Value counts for Technology Used, Drug Manufacturer and Biomarker(s), most
+    common first. Takes the same filters as /search; without filters the counts
+    precomputed when the dataset was loaded are returned.
+    """
+    snapshot = store.get_snapshot()
+    if snapshot is None:
+        return {"error": store.last_error}
+    key = normalize_query({
+        "diagnostic_name": diagnostic_name,
+        "technology_used": technology_used,
+        "indication_sample": indication_sample,
+        "drug_trade_name": drug_trade_name,
+        "drug_manufacturer": drug_manufacturer,
+        "biomarker": biomarker,
+        "biomarker_details": biomarker_details,
+        "fda_approval_date": fda_approval_date,
+        "approved_after": approved_after,
+        "approved_before": approved_before,
+    })
+    if any(key):
+        matched = cached_matches(snapshot, key)
+        counts = snapshot.index.facets(matched)
+    else:
+        matched = range(len(snapshot.rows))
+        counts = snapshot.index.facets()
     return {
-        "columns": columns, 
-        "results": results,
-        "total_matches": len(results),
-        "search_info": search_info
+        "facets": counts,
+        "matched_rows": len(matched),
+        "dataset_version": snapshot.version
     }
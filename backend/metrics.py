@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds for per-stage latencies
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class StageTimer:
+    """Times the stages of one request and formats them as a Server-Timing header."""
+
+    def __init__(self):
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append((name, time.perf_counter() - start))
+
+    def server_timing(self):
+        return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in self.stages)
+
+
+class Metrics:
+    """Process-wide counters and stage latency histograms in Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = defaultdict(int)
+        self.rows_matched = defaultdict(int)
+        self.rows_returned = defaultdict(int)
+        self.stage_counts = defaultdict(int)
+        self.stage_sums = defaultdict(float)
+        self.stage_buckets = defaultdict(lambda: [0] * len(STAGE_BUCKETS))
+
+    def record(self, endpoint, timer, matched=0, returned=0):
+        with self._lock:
+            self.requests[endpoint] += 1
+            self.rows_matched[endpoint] += matched
+            self.rows_returned[endpoint] += returned
+            for name, seconds in timer.stages:
+                key = (endpoint, name)
+                self.stage_counts[key] += 1
+                self.stage_sums[key] += seconds
+                buckets = self.stage_buckets[key]
+                for n, bound in enumerate(STAGE_BUCKETS):
+                    if seconds <= bound:
+                        buckets[n] += 1
+
+    def render(self, gauges=None):
+        """
+        Exposition text for /metrics. `gauges` maps metric name to
+        (help text, value) for point-in-time values owned by other components.
+        """
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            family("cdx_requests_total", "counter", "Requests handled per endpoint.")
+            for endpoint, count in sorted(self.requests.items()):
+                lines.append(f'cdx_requests_total{{endpoint="{endpoint}"}} {count}')
+            family("cdx_rows_matched_total", "counter", "Rows matched by the filter per endpoint.")
+            for endpoint, count in sorted(self.rows_matched.items()):
+                lines.append(f'cdx_rows_matched_total{{endpoint="{endpoint}"}} {count}')
+            family("cdx_rows_returned_total", "counter", "Rows serialized into responses per endpoint.")
+            for endpoint, count in sorted(self.rows_returned.items()):
+                lines.append(f'cdx_rows_returned_total{{endpoint="{endpoint}"}} {count}')
+            family("cdx_stage_seconds", "histogram", "Time spent per request stage.")
+            for (endpoint, stage), count in sorted(self.stage_counts.items()):
+                labels = f'endpoint="{endpoint}",stage="{stage}"'
+                for bound, cumulative in zip(STAGE_BUCKETS, self.stage_buckets[(endpoint, stage)]):
+                    lines.append(f'cdx_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'cdx_stage_seconds_bucket{{{labels},le="+Inf"}} {count}')
+                lines.append(f'cdx_stage_seconds_sum{{{labels}}} {self.stage_sums[(endpoint, stage)]:.6f}')
+                lines.append(f'cdx_stage_seconds_count{{{labels}}} {count}')
+
+        for name, (help_text, value) in (gauges or {}).items():
+            family(name, "counter" if name.endswith("_total") else "gauge", help_text)
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
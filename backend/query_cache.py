@@ -0,0 +1,103 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from search_index import DATE_RANGE_PARAMS, SEARCH_COLUMNS
+
+
+def normalize_query(params):
+    """
+    Cache key for a search: the eight search parameters in a fixed order,
+    trimmed and lowercased, with empty values treated as None, followed by
+    the approval date bounds as ISO strings.
+    """
+    key = []
+    for name in SEARCH_COLUMNS:
+        value = params.get(name)
+        value = value.strip().lower() if value else None
+        key.append(value or None)
+    for name in DATE_RANGE_PARAMS:
+        value = params.get(name)
+        key.append(value.isoformat() if value else None)
+    return tuple(key)
+
+
+def make_etag(version, *parts):
+    """Strong ETag for a response derived from the dataset version and the query."""
+    digest = hashlib.sha256(repr((version,) + parts).encode('utf-8')).hexdigest()[:32]
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or any(tag.replace('W/', '', 1) == etag for tag in candidates)
+
+
+class QueryCache:
+    """
+    Bounded LRU cache with a TTL for search results.
+    Entries belong to one dataset version; the first lookup for a new version
+    drops everything cached for the old one.
+    """
+
+    def __init__(self, max_entries=256, ttl=300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _check_version(self, version):
+        if version != self.version:
+            if self._entries:
+                self.invalidations += 1
+                self._entries.clear()
+            self.version = version
+
+    def get(self, version, key):
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if self.ttl <= 0 or time.time() - stored_at < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, version, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "dataset_version": self.version,
+        }
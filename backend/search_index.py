@@ -0,0 +1,329 @@
+import heapq
+import re
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict
+from itertools import islice
+from typing import Dict, List, Optional, Sequence
+
+from fuzzy import MAX_EDIT_DISTANCE, FuzzyIndex
+
+# Search parameter -> CSV column it is matched against
+SEARCH_COLUMNS = {
+    "diagnostic_name": 'Diagnostic Name (Manufacturer)',
+    "technology_used": 'Technology Used',
+    "indication_sample": 'Indication - Sample Type',
+    "drug_trade_name": 'Drug Trade Name  (Generic)',
+    "drug_manufacturer": 'Drug Manufacturer',
+    "biomarker": 'Biomarker(s)',
+    "biomarker_details": 'Biomarker(s) (Details)',
+    "fda_approval_date": 'FDA CDx Approval Date',
+}
+
+# Inclusive FDA approval date bounds, matched against the sorted date index
+DATE_RANGE_PARAMS = ("approved_after", "approved_before")
+DATE_COLUMN = 'FDA CDx Approval Date'
+ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+# Columns with precomputed value counts for /facets
+FACET_COLUMNS = [
+    'Technology Used',
+    'Drug Manufacturer',
+    'Biomarker(s)',
+]
+
+# Columns searchable with typo/synonym tolerance (fuzzy=true)
+FUZZY_COLUMNS = [
+    'Biomarker(s)',
+    'Drug Trade Name  (Generic)',
+]
+
+GRAM_SIZE = 3
+
+
+def trigrams(text):
+    return {text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)}
+
+
+class TrigramIndex:
+    """Posting lists (sorted row ids) for every trigram of one lowercased column."""
+
+    def __init__(self, values):
+        postings = defaultdict(list)
+        for row_id, value in enumerate(values):
+            for gram in trigrams(value):
+                postings[gram].append(row_id)
+        self.postings: Dict[str, Sequence[int]] = dict(postings)
+
+    @classmethod
+    def from_postings(cls, postings):
+        """Wrap prebuilt posting lists (e.g. views into a compiled snapshot)."""
+        index = cls.__new__(cls)
+        index.postings = postings
+        return index
+
+    def lists_for(self, term):
+        """
+        Posting lists a value containing `term` must appear in, smallest first.
+        Returns None when the term is too short to use the index.
+        """
+        if len(term) < GRAM_SIZE:
+            return None
+        empty: Sequence[int] = ()
+        return sorted((self.postings.get(g, empty) for g in trigrams(term)), key=len)
+
+
+class TableIndex:
+    """
+    Per-column trigram indexes plus lowercased column values for one snapshot.
+    Candidates come from intersecting posting lists (most selective column
+    first) and are then verified with the plain case-insensitive substring
+    check, so results are identical to a full scan. Also holds the approval
+    dates sorted for range queries, the unfiltered facet counts and the
+    typo-tolerant token indexes for the fuzzy columns.
+    """
+
+    def __init__(self, rows):
+        columns = list(SEARCH_COLUMNS.values())
+        self.row_count = len(rows)
+        self.valid = [i for i, row in enumerate(rows) if all(col in row for col in columns)]
+        self.lowered: Dict[str, List[str]] = {
+            col: [(row.get(col) or '').lower() for row in rows] for col in columns
+        }
+        self.columns: Dict[str, TrigramIndex] = {
+            col: TrigramIndex(values) for col, values in self.lowered.items()
+        }
+        valid = set(self.valid)
+        dated = sorted(
+            (date, i) for i, date in enumerate((row.get(DATE_COLUMN) or '').strip() for row in rows)
+            if i in valid and ISO_DATE.match(date)
+        )
+        self.date_keys = [date for date, _ in dated]
+        self.date_rows = [i for _, i in dated]
+        self.facet_values: Dict[str, Sequence[str]] = {
+            col: [(row.get(col) or '').strip() for row in rows] for col in FACET_COLUMNS
+        }
+        self._build_lookups({col: [row.get(col) for row in rows] for col in FUZZY_COLUMNS})
+
+    @classmethod
+    def from_parts(cls, row_count, valid, lowered, postings, date_keys, date_rows,
+                   facet_values, fuzzy_values):
+        """
+        Assemble an index from prebuilt parts (see snapshot_file). Sequences may
+        be lazy views; only the facet counts and fuzzy token indexes, which
+        depend on the distinct values rather than the row count, are rebuilt.
+        """
+        index = cls.__new__(cls)
+        index.row_count = row_count
+        index.valid = valid
+        index.lowered = lowered
+        index.columns = {col: TrigramIndex.from_postings(p) for col, p in postings.items()}
+        index.date_keys = date_keys
+        index.date_rows = date_rows
+        index.facet_values = facet_values
+        index._build_lookups(fuzzy_values)
+        return index
+
+    def _build_lookups(self, fuzzy_values):
+        self.facet_counts: Dict[str, Counter] = {
+            col: Counter(value for value in values if value)
+            for col, values in self.facet_values.items()
+        }
+        self.fuzzy: Dict[str, FuzzyIndex] = {
+            col: FuzzyIndex(values) for col, values in fuzzy_values.items()
+        }
+
+    def date_range(self, after=None, before=None):
+        """Row ids approved on or after `after` and on or before `before` (ISO dates)."""
+        lo = bisect_left(self.date_keys, after) if after else 0
+        hi = bisect_right(self.date_keys, before) if before else len(self.date_keys)
+        return list(self.date_rows[lo:hi])
+
+    def facets(self, row_ids=None):
+        """Value counts per facet column, over `row_ids` or the whole table."""
+        if row_ids is None:
+            counts = self.facet_counts
+        else:
+            counts = {}
+            for col, values in self.facet_values.items():
+                counts[col] = Counter(values[i] for i in row_ids if values[i])
+        return {
+            col: [{"value": value, "count": count}
+                  for value, count in sorted(counter.items(), key=lambda item: (-item[1], item[0]))]
+            for col, counter in counts.items()
+        }
+
+    def candidates(self, terms):
+        """Row ids that may match every (column, lowercased term) pair, or None if unindexed."""
+        plans = []
+        for col, term in terms:
+            lists = self.columns[col].lists_for(term)
+            if lists is not None:
+                plans.append(lists)
+        if not plans:
+            return None
+        # Start from the column whose rarest trigram has the fewest rows
+        plans.sort(key=lambda lists: len(lists[0]))
+        result: Optional[set] = None
+        for lists in plans:
+            for postings in lists:
+                result = set(postings) if result is None else result.intersection(postings)
+                if not result:
+                    return []
+        return sorted(result)
+
+    def _plan(self, terms, after=None, before=None):
+        """(lowered column/term pairs, candidate ids or None for a full scan)."""
+        active = [(col, term.lower()) for col, term in terms.items() if term]
+        lowered = [(self.lowered[col], term) for col, term in active]
+        if after or before:
+            dated = self.date_range(after, before)
+            candidates = self.candidates(active) if active else None
+            if candidates is None:
+                return lowered, sorted(dated)
+            dated = set(dated)
+            return lowered, [i for i in candidates if i in dated]
+        if not active:
+            return lowered, self.valid
+        candidates = self.candidates(active)
+        if candidates is not None and len(self.valid) != self.row_count:
+            valid = set(self.valid)
+            candidates = [i for i in candidates if i in valid]
+        return lowered, candidates
+
+    def iter_search(self, terms, after=None, before=None):
+        """
+        Yield row ids (in table order) whose columns contain every search term.
+        `terms` maps column name -> search term; empty terms are ignored.
+        `after`/`before` restrict the FDA approval date (inclusive ISO dates).
+        """
+        lowered, candidates = self._plan(terms, after, before)
+        for i in self.valid if candidates is None else candidates:
+            if all(term in values[i] for values, term in lowered):
+                yield i
+
+    def search(self, terms, after=None, before=None):
+        return list(self.iter_search(terms, after, before))
+
+    def search_many(self, queries):
+        """
+        Evaluate several (terms, after, before) queries at once and return one
+        id list per query. Indexed queries are answered from posting lists; the
+        rest share a single scan over the table instead of one scan each.
+        """
+        results: List[List[int]] = []
+        scans = []
+        for terms, after, before in queries:
+            lowered, candidates = self._plan(terms, after, before)
+            ids: List[int] = []
+            if candidates is None:
+                scans.append((ids, lowered))
+            else:
+                ids.extend(i for i in candidates if all(term in values[i] for values, term in lowered))
+            results.append(ids)
+        if scans:
+            for i in self.valid:
+                for ids, lowered in scans:
+                    if all(term in values[i] for values, term in lowered):
+                        ids.append(i)
+        return results
+
+    def _iter_containing(self, col, term):
+        """Lazily yield row ids (in table order) whose `col` contains lowercased `term`."""
+        lists = self.columns[col].lists_for(term)
+        values = self.lowered[col]
+        for i in range(self.row_count) if lists is None else lists[0]:
+            if term in values[i]:
+                yield i
+
+    def fuzzy_search(self, terms, after=None, before=None, top_k=50):
+        """
+        Ranked matches when terms in FUZZY_COLUMNS may be misspelt or use a
+        synonym. Returns up to `top_k` (row id, cost) pairs ordered by cost,
+        where an exact substring match costs 0 and each fuzzy token costs its
+        edit distance, plus the tokens each fuzzy term was expanded to. Terms
+        for other columns and the date range still filter exactly.
+
+        Rows are pulled from the posting lists of the rarest query token's
+        expansions one distance bucket at a time, in table order within a
+        bucket, and the walk stops as soon as the first `top_k` rows by (cost,
+        row id) are settled, so the work is bounded by `top_k` rather than the
+        row count and a smaller `top_k` always returns a prefix of a larger one.
+        """
+        fuzzy_terms = {col: term for col, term in terms.items() if term and col in self.fuzzy}
+        exact_terms = {col: term for col, term in terms.items() if col not in fuzzy_terms}
+        if not fuzzy_terms:
+            ids = islice(self.iter_search(exact_terms, after, before), top_k)
+            return [(i, 0) for i in ids], {}
+
+        exact = [(self.lowered[col], term.lower()) for col, term in exact_terms.items() if term]
+        if after or before:
+            allowed = set(self.date_range(after, before))
+        elif len(self.valid) != self.row_count:
+            allowed = set(self.valid)
+        else:
+            allowed = None
+
+        plans = {col: self.fuzzy[col].plan(term) for col, term in fuzzy_terms.items()}
+        expanded = {}
+        for col, plan in plans.items():
+            expanded[col] = [t for matches in plan
+                             for t in sorted(matches, key=lambda t: (matches[t], t))]
+        lowered_terms = {col: term.lower() for col, term in fuzzy_terms.items()}
+
+        def cost(i):
+            if allowed is not None and i not in allowed:
+                return None
+            if not all(term in values[i] for values, term in exact):
+                return None
+            total = 0
+            for col, term in lowered_terms.items():
+                if term in self.lowered[col][i]:
+                    continue
+                col_cost = self.fuzzy[col].row_cost(i, plans[col])
+                if col_cost is None:
+                    return None
+                total += col_cost
+            return total
+
+        # Every match holds an expansion of each query token of each fuzzy
+        # term, or contains that term outright, so walking the rarest token's
+        # expansions (plus the term's substring matches) reaches all of them.
+        # A row first reached in a bucket costs at least that bucket's distance.
+        def postings_size(item):
+            col, matches = item
+            return sum(len(self.fuzzy[col].postings[token]) for token in matches)
+
+        driver, driver_matches = min(
+            ((col, matches) for col, plan in plans.items() for matches in plan),
+            key=postings_size, default=(next(iter(fuzzy_terms)), {}))
+        scored: Dict[int, int] = {}
+        seen = set()
+        for distance in range(MAX_EDIT_DISTANCE + 1):
+            sources = [self.fuzzy[driver].postings[token]
+                       for token, d in driver_matches.items() if d == distance]
+            if distance == 0:
+                sources.append(self._iter_containing(driver, lowered_terms[driver]))
+            # Rows cheaper than this bucket were all reached in earlier ones.
+            # Rows tied with it may come from earlier buckets too, so a walk
+            # cut short mid-bucket only counts those ranked before the current
+            # row id; later rows of this bucket could still win the tie.
+            below = sum(1 for c in scored.values() if c < distance)
+            earlier_ties = sorted(i for i, c in scored.items() if c == distance)
+            bucket_ties = 0
+            # Merged so each bucket is walked in table order, like exact search
+            for i in heapq.merge(*sources):
+                if i in seen:
+                    continue
+                seen.add(i)
+                row_cost = cost(i)
+                if row_cost is None:
+                    continue
+                scored[i] = row_cost
+                if row_cost == distance:
+                    bucket_ties += 1
+                    if below + bucket_ties + bisect_right(earlier_ties, i) >= top_k:
+                        break
+            if below + bucket_ties + len(earlier_ties) >= top_k:
+                break
+        ranked = heapq.nsmallest(top_k, scored.items(), key=lambda item: (item[1], item[0]))
+        return ranked, expanded
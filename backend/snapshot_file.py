@@ -0,0 +1,290 @@
+"""
+Compile Table_Data.csv into a binary snapshot that workers memory-map.
+
+Layout: an 8-byte magic, a little JSON header (source hash, columns, section
+offsets), then 8-byte aligned sections of native uint32 arrays:
+
+- strings:offsets / strings:data  interned string table (every distinct cell
+                                  value and lowercased search value, once)
+- cell:<column>                   string id of each row's value, one array per column
+                                  (MISSING for cells absent from short rows)
+- lower:<column>                  lowercased search column values
+- facet:<column>                  stripped facet column values
+- grams:<column> / postings:<column>
+                                  trigram posting lists: (gram string id, offset,
+                                  length) triples into the postings array
+- valid, date_keys, date_rows     rows with every search column, and the sorted
+                                  approval date index
+- json:offsets / json:data        each row pre-serialized as a JSON object
+
+Loading decodes the string table once and wraps everything else as zero-copy
+views into the mapping, so every uvicorn worker shares the same pages.
+
+    python snapshot_file.py ../data/Table_Data.csv [output.cdxsnap]
+"""
+import hashlib
+import json
+import mmap
+import os
+import sys
+from array import array
+from typing import Dict, List
+
+from dataset import DatasetSnapshot, parse_table
+from responses import row_fragments
+from search_index import FACET_COLUMNS, FUZZY_COLUMNS, SEARCH_COLUMNS, TableIndex
+
+MAGIC = b"CDXSNAP1"
+FORMAT_VERSION = 3
+ALIGN = 8
+# String id of a cell missing from a short row (read back as None, like the CSV parser)
+MISSING = 0xFFFFFFFF
+
+
+def snapshot_path_for(csv_path):
+    return os.path.splitext(csv_path)[0] + ".cdxsnap"
+
+
+def source_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class StringColumn:
+    """Read-only sequence of strings given by ids into a string table (MISSING -> None)."""
+
+    def __init__(self, strings, ids):
+        self.strings = strings
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            strings = self.strings
+            return [None if sid == MISSING else strings[sid] for sid in self.ids[i]]
+        sid = self.ids[i]
+        return None if sid == MISSING else self.strings[sid]
+
+    def __iter__(self):
+        strings = self.strings
+        return (None if sid == MISSING else strings[sid] for sid in self.ids)
+
+
+class BytesColumn:
+    """Read-only sequence of byte strings sliced out of one buffer by offsets."""
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]]
+
+
+class ColumnarRows:
+    """
+    Read-only sequence of row dicts materialized on access from per-column
+    string ids, so a loaded snapshot holds no per-row Python objects.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.names = list(columns)
+        self._length = len(next(iter(columns.values()))) if columns else 0
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[n] for n in range(*i.indices(self._length))]
+        if i < 0:
+            i += self._length
+        if not 0 <= i < self._length:
+            raise IndexError(i)
+        return {name: values[i] for name, values in self.columns.items()}
+
+    def __iter__(self):
+        return (self[i] for i in range(self._length))
+
+
+class _Writer:
+    def __init__(self):
+        self.strings: List[str] = []
+        self.ids: Dict[str, int] = {}
+        self.sections = []
+
+    def intern(self, value):
+        sid = self.ids.get(value)
+        if sid is None:
+            sid = self.ids[value] = len(self.strings)
+            self.strings.append(value)
+        return sid
+
+    def ids_for(self, values):
+        return array('I', (MISSING if value is None else self.intern(value) for value in values))
+
+    def add(self, name, data):
+        self.sections.append((name, data))
+
+
+def compile_snapshot(data, path):
+    """Compile CSV bytes into a snapshot file at `path` (written atomically)."""
+    text = data.decode('utf-8')
+    rows = parse_table(text)
+    index = TableIndex(rows)
+    # DictReader files surplus fields under a None key; only named columns are stored
+    names = [name for name in rows[0] if name is not None] if rows else []
+    writer = _Writer()
+
+    for name in names:
+        writer.add(f"cell:{name}", writer.ids_for(row.get(name) for row in rows))
+    for col, values in index.lowered.items():
+        writer.add(f"lower:{col}", writer.ids_for(values))
+    for col, values in index.facet_values.items():
+        writer.add(f"facet:{col}", writer.ids_for(values))
+    for col, trigram_index in index.columns.items():
+        grams = array('I')
+        postings = array('I')
+        for gram, ids in trigram_index.postings.items():
+            grams.extend((writer.intern(gram), len(postings), len(ids)))
+            postings.extend(ids)
+        writer.add(f"grams:{col}", grams)
+        writer.add(f"postings:{col}", postings)
+    writer.add("valid", array('I', index.valid))
+    writer.add("date_keys", writer.ids_for(index.date_keys))
+    writer.add("date_rows", array('I', index.date_rows))
+    fragments = row_fragments(rows)
+    json_offsets = array('I', [0])
+    for fragment in fragments:
+        json_offsets.append(json_offsets[-1] + len(fragment))
+    writer.add("json:offsets", json_offsets)
+    writer.add("json:data", b"".join(fragments))
+
+    encoded = [s.encode('utf-8') for s in writer.strings]
+    offsets = array('I', [0])
+    for blob in encoded:
+        offsets.append(offsets[-1] + len(blob))
+    writer.sections[:0] = [("strings:offsets", offsets), ("strings:data", b"".join(encoded))]
+
+    payload = []
+    layout = {}
+    position = 0
+    for name, section in writer.sections:
+        raw = section.tobytes() if isinstance(section, array) else section
+        layout[name] = [position, len(raw)]
+        padding = -len(raw) % ALIGN
+        payload.append(raw + b"\0" * padding)
+        position += len(raw) + padding
+
+    header = json.dumps({
+        "format": FORMAT_VERSION,
+        "byteorder": sys.byteorder,
+        "source_sha256": source_hash(data),
+        "rows": len(rows),
+        "columns": names,
+        "fuzzy_columns": FUZZY_COLUMNS,
+        "sections": layout,
+    }).encode('utf-8')
+    header += b" " * (-(len(MAGIC) + 4 + len(header)) % ALIGN)
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(4, 'little'))
+        f.write(header)
+        for chunk in payload:
+            f.write(chunk)
+    os.replace(tmp, path)
+    return path
+
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            return None
+        length = int.from_bytes(f.read(4), 'little')
+        return json.loads(f.read(length))
+
+
+def load_snapshot(path, source="local"):
+    """Memory-map a compiled snapshot and wrap it as a DatasetSnapshot."""
+    with open(path, 'rb') as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapping)
+    length = int.from_bytes(view[len(MAGIC):len(MAGIC) + 4], 'little')
+    start = len(MAGIC) + 4
+    header = json.loads(bytes(view[start:start + length]))
+    base = start + length
+    sections = header["sections"]
+
+    def raw(name):
+        offset, size = sections[name]
+        return view[base + offset:base + offset + size]
+
+    def uints(name):
+        return raw(name).cast('I')
+
+    offsets = uints("strings:offsets")
+    data = raw("strings:data")
+    strings = [str(data[offsets[i]:offsets[i + 1]], 'utf-8') for i in range(len(offsets) - 1)]
+
+    columns = {name: StringColumn(strings, uints(f"cell:{name}")) for name in header["columns"]}
+    search_columns = list(SEARCH_COLUMNS.values())
+    postings = {}
+    for col in search_columns:
+        grams = uints(f"grams:{col}")
+        lists = uints(f"postings:{col}")
+        postings[col] = {
+            strings[grams[n]]: lists[grams[n + 1]:grams[n + 1] + grams[n + 2]]
+            for n in range(0, len(grams), 3)
+        }
+    index = TableIndex.from_parts(
+        row_count=header["rows"],
+        valid=uints("valid"),
+        lowered={col: StringColumn(strings, uints(f"lower:{col}")) for col in search_columns},
+        postings=postings,
+        date_keys=StringColumn(strings, uints("date_keys")),
+        date_rows=uints("date_rows"),
+        facet_values={col: StringColumn(strings, uints(f"facet:{col}")) for col in FACET_COLUMNS},
+        fuzzy_values={col: columns[col] for col in header["fuzzy_columns"] if col in columns},
+    )
+    fragments = BytesColumn(raw("json:data"), uints("json:offsets"))
+    snapshot = DatasetSnapshot(ColumnarRows(columns), header["source_sha256"][:16], source,
+                               index=index, fragments=fragments)
+    # Keep the mapping alive for as long as the snapshot's views are in use
+    snapshot.mapping = mapping
+    return snapshot
+
+
+def load_or_build(csv_path, path=None):
+    """
+    Load the compiled snapshot for `csv_path`, recompiling it first when it is
+    missing, unreadable or was built from different CSV contents.
+    """
+    path = path or snapshot_path_for(csv_path)
+    with open(csv_path, 'rb') as f:
+        data = f.read()
+    try:
+        header = read_header(path)
+    except (OSError, ValueError):
+        header = None
+    if (header is None or header.get("format") != FORMAT_VERSION
+            or header.get("byteorder") != sys.byteorder
+            or header.get("source_sha256") != source_hash(data)):
+        compile_snapshot(data, path)
+    return load_snapshot(path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        sys.exit(f"usage: {sys.argv[0]} CSV_PATH [SNAPSHOT_PATH]")
+    csv_path = sys.argv[1]
+    out = sys.argv[2] if len(sys.argv) == 3 else snapshot_path_for(csv_path)
+    with open(csv_path, 'rb') as f:
+        compile_snapshot(f.read(), out)
+    print(f"Compiled {csv_path} -> {out} ({os.path.getsize(out)} bytes)")
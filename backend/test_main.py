@@ -1,5 +1,6 @@
 from fastapi.testclient import TestClient
 import pytest
+import main
 from main import app
 
 client = TestClient(app)
@@ -7,7 +8,9 @@ client = TestClient(app)
 def test_root():
     response = client.get("/")
     assert response.status_code == 200
-    assert response.json() == {"message": "CDx Backend API is running", "endpoints": ["/search"]}
+    data = response.json()
+    assert data["message"] == "CDx Backend API is running"
+    assert "/search" in data["endpoints"]
 
 def test_search_no_params():
     response = client.get("/search")
@@ -15,32 +18,454 @@ def test_search_no_params():
     data = response.json()
     assert "columns" in data
     assert "results" in data
-    assert data["columns"] == ['Tumor Type', 'Test', 'Gene mutations', 'Therapy']
+    assert data["columns"] == main.COLUMNS
+    assert data["total_matches"] == len(data["results"]) == data["search_info"]["total_rows"]
 
-def test_search_with_tumor_type():
-    response = client.get("/search?tumor_type=Lung")
+def test_search_with_indication_sample():
+    response = client.get("/search?indication_sample=Lung")
     assert response.status_code == 200
     data = response.json()
     assert "results" in data
-    # All results should contain "lung" (case-insensitive) in their tumor type
+    assert data["results"]
+    # All results should contain "lung" (case-insensitive) in their indication
     for result in data["results"]:
-        assert "lung" in result["Tumor Type"].lower()
+        assert "lung" in result["Indication - Sample Type"].lower()
 
 def test_search_with_multiple_params():
-    response = client.get("/search?tumor_type=Lung&test=PCR")
+    response = client.get("/search?indication_sample=Lung&technology_used=PCR")
     assert response.status_code == 200
     data = response.json()
     assert "results" in data
-    # All results should contain both "lung" in tumor type and "PCR" in test (case-insensitive)
+    assert data["results"]
+    # All results should contain both "lung" in indication and "PCR" in technology (case-insensitive)
     for result in data["results"]:
-        assert "lung" in result["Tumor Type"].lower()
-        assert "pcr" in result["Test"].lower()
+        assert "lung" in result["Indication - Sample Type"].lower()
+        assert "pcr" in result["Technology Used"].lower()
 
 def test_search_case_insensitive():
-    response = client.get("/search?tumor_type=lung")
+    upper = client.get("/search?indication_sample=LUNG").json()
+    response = client.get("/search?indication_sample=lung")
     assert response.status_code == 200
     data = response.json()
     assert "results" in data
-    # Should find results despite lowercase query
+    # Should find the same results despite lowercase query
+    assert data["results"] == upper["results"]
+    for result in data["results"]:
+        assert "lung" in result["Indication - Sample Type"].lower()
+
+def test_dataset_info():
+    client.get("/search")
+    response = client.get("/dataset")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["version"]
+    assert data["rows"] > 0
+    assert data["age_seconds"] >= 0
+
+def test_refresh_serves_stale_snapshot_on_failure():
+    import asyncio
+    import httpx
+    import dataset
+    sent = {}
+    def handler(request):
+        sent.update(request.headers)
+        if sent.get("if-none-match") == '"offline"':
+            raise httpx.ConnectError("offline")
+        return httpx.Response(304)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    store = dataset.DatasetStore("http://example.invalid/data.csv", main.DATA_PATH, client=client)
+    snapshot = store.get_snapshot()
+
+    store.etag = '"abc"'
+    assert asyncio.run(store.refresh()) is snapshot
+    assert sent["if-none-match"] == '"abc"'
+
+    store.etag = '"offline"'
+    assert asyncio.run(store.refresh()) is snapshot
+    assert store.last_error == "offline"
+
+def test_concurrent_refreshes_share_one_fetch():
+    import asyncio
+    import httpx
+    import dataset
+    with open(main.DATA_PATH, "rb") as f:
+        body = f.read()
+
+    async def run():
+        async def handler(request):
+            await asyncio.sleep(0.05)
+            return httpx.Response(200, content=body, headers={"ETag": '"v1"'})
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        store = dataset.DatasetStore("http://example.invalid/data.csv", None, client=client)
+        snapshots = await asyncio.gather(*[store.refresh() for _ in range(10)])
+        return store, snapshots
+
+    store, snapshots = asyncio.run(run())
+    assert store.fetches == 1
+    assert all(s is snapshots[0] for s in snapshots)
+    assert snapshots[0].source == "github"
+    assert store.etag == '"v1"'
+
+def test_failed_reload_keeps_validators():
+    import asyncio
+    import httpx
+    import dataset
+
+    def handler(request):
+        # Looks changed, but the new body cannot be installed
+        return httpx.Response(200, content=b"", headers={"ETag": '"empty"', "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    store = dataset.DatasetStore("http://example.invalid/data.csv", main.DATA_PATH, client=client)
+    snapshot = store.get_snapshot()
+    store.etag = '"abc"'
+    assert asyncio.run(store.refresh()) is snapshot
+    assert store.last_error == "remote table is empty"
+    assert store.etag == '"abc"'
+    assert store.last_modified is None
+
+def test_trigram_index_matches_linear_scan():
+    from search_index import SEARCH_COLUMNS, TableIndex
+    table = main.store.get_snapshot().rows
+    index = TableIndex(table)
+    queries = [
+        {"biomarker": "EGFR"},
+        {"biomarker": "her2", "technology_used": "ihc"},
+        {"technology_used": "NGS", "indication_sample": "lung"},
+        {"drug_trade_name": "ib"},  # shorter than a trigram, falls back to a scan
+        {"fda_approval_date": "2020-", "technology_used": "PCR"},
+        {"biomarker": "no such marker"},
+    ]
+    for query in queries:
+        terms = {SEARCH_COLUMNS[k]: v for k, v in query.items()}
+        expected = [
+            i for i, row in enumerate(table)
+            if all(v.lower() in (row[col] or '').lower() for col, v in terms.items())
+        ]
+        assert index.search(terms) == expected, query
+
+def test_search_pagination_and_fields():
+    full = client.get("/search?technology_used=NGS").json()
+    first = client.get("/search?technology_used=NGS&limit=5").json()
+    assert first["total_matches"] == full["total_matches"]
+    assert first["results"] == full["results"][:5]
+    second = client.get(f"/search?technology_used=NGS&limit=5&cursor={first['next_cursor']}").json()
+    assert second["results"] == full["results"][5:10]
+
+    fields = "Biomarker(s),Technology Used"
+    projected = client.get("/search", params={"technology_used": "NGS", "fields": fields}).json()
+    assert projected["columns"] == ["Biomarker(s)", "Technology Used"]
+    assert all(set(row) == {"Biomarker(s)", "Technology Used"} for row in projected["results"])
+    repeated = client.get("/search", params={"fields": ["Biomarker(s),Biomarker(s)", "Biomarker(s)"]}).json()
+    assert repeated["columns"] == ["Biomarker(s)"]
+
+    assert client.get("/search", params={"fields": "Tumor Type"}).status_code == 400
+
+def test_search_ndjson_stream():
+    import json
+    full = client.get("/search?technology_used=NGS").json()
+    response = client.get("/search?technology_used=NGS&format=ndjson")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert rows == full["results"]
+
+def test_ndjson_metrics_recorded_after_stream():
+    before = (main.metrics.requests["search"], main.metrics.rows_returned["search"],
+              main.metrics.stage_counts[("search", "stream")])
+    response = client.get("/search?technology_used=NGS&format=ndjson&limit=5")
+    assert "stream;dur=" not in response.headers["server-timing"]
+    assert len(response.text.splitlines()) == 5
+    after = (main.metrics.requests["search"], main.metrics.rows_returned["search"],
+             main.metrics.stage_counts[("search", "stream")])
+    assert after == (before[0] + 1, before[1] + 5, before[2] + 1)
+
+def test_search_cache_and_etag():
+    main.query_cache.clear()
+    before = main.query_cache.stats()
+    first = client.get("/search", params={"biomarker": " EGFR "})
+    second = client.get("/search", params={"biomarker": "egfr"})
+    after = main.query_cache.stats()
+    assert after["misses"] == before["misses"] + 1
+    assert after["hits"] == before["hits"] + 1
+    assert first.json()["results"] == second.json()["results"]
+
+    # Same cached rows, but the bodies echo different raw terms
+    assert first.json()["search_info"] != second.json()["search_info"]
+    etag = first.headers["etag"]
+    assert second.headers["etag"] != etag
+    cached = client.get("/search", params={"biomarker": " EGFR "}, headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert client.get("/search", params={"biomarker": "egfr"}, headers={"If-None-Match": etag}).status_code == 200
+    other_page = client.get("/search", params={"biomarker": "EGFR", "limit": 1}, headers={"If-None-Match": etag})
+    assert other_page.status_code == 200
+
+    # A blank term is dropped by normalization, and echoed as not sent
+    blank = client.get("/search", params={"biomarker": "  "}).json()
+    assert blank["search_info"]["search_terms"]["biomarker"] is None
+    assert blank["total_matches"] == client.get("/search").json()["total_matches"]
+
+def test_query_cache_invalidates_on_new_version():
+    from query_cache import QueryCache
+    cache = QueryCache(max_entries=2)
+    cache.put("v1", ("a",), (1,))
+    cache.put("v1", ("b",), (2,))
+    cache.put("v1", ("c",), (3,))
+    assert cache.get("v1", ("a",)) is None
+    assert cache.evictions == 1
+    assert cache.get("v1", ("c",)) == (3,)
+    assert cache.get("v2", ("c",)) is None
+    assert cache.stats()["invalidations"] == 1
+
+def test_search_batch():
+    queries = [
+        {"biomarker": "EGFR"},
+        {"biomarker": "egfr "},
+        {"biomarker": "ALK", "indication_sample": "lung"},
+        {"technology_used": "IH"},
+        {"biomarker": "no such marker"},
+    ]
+    response = client.post("/search/batch", json={"queries": queries})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["total_queries"] == len(queries)
+    for query, result in zip(queries, data["results"]):
+        single = client.get("/search", params=query).json()
+        assert result["total_matches"] == single["total_matches"]
+        assert [data["rows"][str(i)] for i in result["row_ids"]] == single["results"]
+    assert data["unique_rows"] == len(data["rows"])
+
+    too_many = {"queries": [{"biomarker": "EGFR"}] * (main.MAX_BATCH_QUERIES + 1)}
+    assert client.post("/search/batch", json=too_many).status_code == 400
+
+def test_search_approval_date_range():
+    data = client.get("/search?approved_after=2020-01-01&approved_before=2020-12-31&technology_used=NGS").json()
+    assert data["total_matches"] > 0
     for result in data["results"]:
-        assert "lung" in result["Tumor Type"].lower() 
\ No newline at end of file
+        assert "2020-01-01" <= result["FDA CDx Approval Date"] <= "2020-12-31"
+        assert "ngs" in result["Technology Used"].lower()
+    everything = client.get("/search").json()["results"]
+    expected = [r for r in everything if "2020-01-01" <= r["FDA CDx Approval Date"] <= "2020-12-31"
+                and "ngs" in r["Technology Used"].lower()]
+    assert data["results"] == expected
+    assert client.get("/search?approved_after=not-a-date").status_code == 422
+
+def test_facets():
+    data = client.get("/facets").json()
+    technologies = {f["value"]: f["count"] for f in data["facets"]["Technology Used"]}
+    rows = client.get("/search").json()["results"]
+    assert technologies["NGS"] == sum(1 for r in rows if r["Technology Used"] == "NGS")
+    counts = [f["count"] for f in data["facets"]["Biomarker(s)"]]
+    assert counts == sorted(counts, reverse=True)
+
+    filtered = client.get("/facets?technology_used=NGS").json()
+    assert [f["value"] for f in filtered["facets"]["Technology Used"]] == ["NGS"]
+    assert filtered["matched_rows"] == technologies["NGS"]
+
+def test_server_timing_and_metrics():
+    response = client.get("/search?biomarker=BRAF")
+    timing = response.headers["server-timing"]
+    for stage in ("load", "filter", "serialize"):
+        assert f"{stage};dur=" in timing
+
+    metrics = client.get("/metrics")
+    assert metrics.status_code == 200
+    assert metrics.headers["content-type"].startswith("text/plain")
+    text = metrics.text
+    assert 'cdx_requests_total{endpoint="search"}' in text
+    assert 'cdx_stage_seconds_count{endpoint="search",stage="filter"}' in text
+    assert "cdx_query_cache_hits_total" in text
+    assert "cdx_dataset_rows 188" in text
+
+def test_benchmark_synthetic_table():
+    import benchmark
+    source = benchmark.load_source_rows()
+    rows = benchmark.synthetic_table(source, 500, seed=1)
+    assert len(rows) == 500
+    assert set(rows[0]) == set(main.COLUMNS)
+    assert len({row["Diagnostic Name (Manufacturer)"] for row in rows}) == 500
+
+def test_fuzzy_biomarker_and_drug_lookup():
+    exact = client.get("/search", params={"biomarker": "HER-2"}).json()
+    assert exact["total_matches"] == 0
+
+    data = client.get("/search", params={"biomarker": "HER-2", "fuzzy": "true"}).json()
+    assert data["total_matches"] > 0
+    assert all("erbb2" in r["Biomarker(s)"].lower() for r in data["results"])
+    assert "erbb2" in data["search_info"]["fuzzy"]["expanded_terms"]["biomarker"]
+
+    typo = client.get("/search", params={"drug_trade_name": "osimertnib", "fuzzy": "true", "top_k": 3}).json()
+    assert 0 < len(typo["results"]) <= 3
+    assert all("osimertinib" in r["Drug Trade Name  (Generic)"] for r in typo["results"])
+    assert typo["search_info"]["fuzzy"]["match_costs"] == [1] * len(typo["results"])
+
+    # Exact matches rank ahead of fuzzy ones
+    ranked = client.get("/search", params={"drug_trade_name": "Tagriso", "fuzzy": "true"}).json()
+    costs = ranked["search_info"]["fuzzy"]["match_costs"]
+    assert costs == sorted(costs)
+
+def test_fuzzy_top_k_stops_early_with_same_ranking():
+    from search_index import SEARCH_COLUMNS, TableIndex
+    index = main.store.get_snapshot().index
+    for terms, after in [({"biomarker": "HER-2"}, None),
+                         ({"drug_trade_name": "osimertnib", "technology_used": "ngs"}, None),
+                         ({"biomarker": "erbb2", "drug_trade_name": "trastuzumab"}, "2015-01-01")]:
+        terms = {SEARCH_COLUMNS[k]: v for k, v in terms.items()}
+        full, expanded = index.fuzzy_search(terms, after, top_k=500)
+        for top_k in (1, 3):
+            assert index.fuzzy_search(terms, after, top_k=top_k) == (full[:top_k], expanded)
+
+    # A tie first reached through a costlier token must not be cut off by rows
+    # reached earlier with the same total cost
+    rows = [{col: "" for col in SEARCH_COLUMNS.values()} for _ in range(7)]
+    for row, (marker, drug) in zip(rows, [("pembrolizumab", "osimertinib"), ("pembrolizumax", "osimertnib")]
+                                   + [("pembrolizumab", "other")] * 5):
+        row.update({SEARCH_COLUMNS["biomarker"]: marker, SEARCH_COLUMNS["drug_trade_name"]: drug})
+    index = TableIndex(rows)
+    terms = {SEARCH_COLUMNS["biomarker"]: "pembrolizumab", SEARCH_COLUMNS["drug_trade_name"]: "osimertnib"}
+    assert index.fuzzy_search(terms, top_k=100)[0] == [(0, 1), (1, 1)]
+    assert index.fuzzy_search(terms, top_k=1)[0] == [(0, 1)]
+
+def test_compiled_snapshot_matches_csv(tmp_path):
+    import shutil
+    import snapshot_file
+    from dataset import DatasetSnapshot
+    from search_index import SEARCH_COLUMNS
+    csv_path = tmp_path / "Table_Data.csv"
+    shutil.copy(main.DATA_PATH, csv_path)
+    with open(csv_path, "rb") as f:
+        parsed = DatasetSnapshot.from_text(f.read().decode("utf-8"), "local")
+
+    compiled = snapshot_file.load_or_build(str(csv_path))
+    assert (tmp_path / "Table_Data.cdxsnap").exists()
+    assert compiled.version == parsed.version
+    assert list(compiled.rows) == parsed.rows
+    assert compiled.index.facets() == parsed.index.facets()
+    assert [bytes(compiled.fragments[i]) for i in range(len(parsed.rows))] == parsed.fragments
+    for terms in [{"biomarker": "EGFR"}, {"technology_used": "ngs", "indication_sample": "lung"},
+                  {"drug_trade_name": "ib"}]:
+        terms = {SEARCH_COLUMNS[k]: v for k, v in terms.items()}
+        assert compiled.index.search(terms) == parsed.index.search(terms)
+    assert compiled.index.search({}, "2020-01-01", "2020-12-31") == parsed.index.search({}, "2020-01-01", "2020-12-31")
+
+    # Editing the CSV invalidates the compiled snapshot
+    with open(csv_path, "a", encoding="utf-8") as f:
+        f.write("\nNew Test (Lab),NGS,Lung - Tissue,Drug (generic),Pharma,NEWMARKER,Details,2025-02-01,P000001,NDA 1\n")
+    rebuilt = snapshot_file.load_or_build(str(csv_path))
+    assert len(rebuilt.rows) == len(parsed.rows) + 1
+    assert rebuilt.version != parsed.version
+    assert rebuilt.index.search({SEARCH_COLUMNS["biomarker"]: "newmarker"}) == [len(parsed.rows)]
+
+def test_compiled_snapshot_handles_ragged_rows(tmp_path):
+    import snapshot_file
+    from dataset import DatasetSnapshot
+    header = ",".join(f'"{name}"' for name in main.COLUMNS)
+    text = header + ("\nA (Lab),NGS,Lung - Tissue,Drug (generic),Pharma,EGFR,Details,2020-01-01,P1,NDA 1,surplus"
+                     "\nB (Lab),PCR,Blood\n")
+    path = str(tmp_path / "ragged.cdxsnap")
+    snapshot_file.compile_snapshot(text.encode("utf-8"), path)
+    compiled = snapshot_file.load_snapshot(path)
+    assert list(compiled.rows[0]) == main.COLUMNS
+    assert compiled.rows[0]["Biomarker(s)"] == "EGFR"
+
+    # Cells missing from a short row read back as None, as from the parsed CSV
+    parsed = DatasetSnapshot.from_text(text, "local")
+    assert compiled.rows[1] == parsed.rows[1]
+    assert compiled.rows[1]["Biomarker(s)"] is None
+    assert main.project(compiled.rows[1], ["Biomarker(s)"]) == main.project(parsed.rows[1], ["Biomarker(s)"])
+
+def test_search_response_from_fragments_and_compression():
+    import gzip
+    import json
+    response = client.get("/search?biomarker=EGFR", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert "Accept-Encoding" in response.headers["vary"]
+    data = response.json()
+    assert set(data) == {"columns", "results", "total_matches", "next_cursor", "search_info"}
+    assert data["columns"] == main.COLUMNS
+    assert all(set(row) == set(main.COLUMNS) for row in data["results"])
+
+    compressed = client.get("/search?biomarker=EGFR", headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert compressed.json() == data
+    assert compressed.headers["etag"] != response.headers["etag"]
+
+    # The full listing is encoded once per snapshot and content coding
+    snapshot = main.store.get_snapshot()
+    snapshot.listing_cache.clear()
+    first = client.get("/search", headers={"Accept-Encoding": "gzip"})
+    cached = snapshot.listing_cache["gzip"]
+    second = client.get("/search", headers={"Accept-Encoding": "gzip"})
+    assert snapshot.listing_cache["gzip"] is cached
+    assert json.loads(gzip.decompress(cached)) == first.json() == second.json()
+    assert len(first.json()["results"]) == len(snapshot.rows)
+
+def test_negotiate_encoding():
+    from responses import negotiate_encoding
+    assert negotiate_encoding(None) is None
+    assert negotiate_encoding("gzip, deflate") == "gzip"
+    assert negotiate_encoding("gzip;q=0, identity") is None
+    assert negotiate_encoding("*") in ("br", "gzip")
+
+def test_start_keeps_compiled_snapshot_when_upstream_matches(tmp_path):
+    import asyncio
+    import shutil
+    import httpx
+    import dataset
+    from snapshot_file import ColumnarRows
+    csv_path = tmp_path / "Table_Data.csv"
+    shutil.copy(main.DATA_PATH, csv_path)
+    with open(csv_path, "rb") as f:
+        body = f.read()
+
+    sent = []
+
+    async def run():
+        def handler(request):
+            sent.append(request.headers.get("if-none-match"))
+            if request.headers.get("if-none-match") == '"v1"':
+                return httpx.Response(304)
+            return httpx.Response(200, content=body, headers={"ETag": '"v1"'})
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        store = dataset.DatasetStore("http://example.invalid/data.csv", str(csv_path), refresh_interval=0,
+                                     client=client, snapshot_path=str(tmp_path / "Table_Data.cdxsnap"))
+        await store.start()
+        # Startup does not wait on the upstream; its revalidation runs in the background
+        assert store.info()["refreshing"]
+        await store.refresh()
+        await store.stop()
+        return store
+
+    store = asyncio.run(run())
+    assert store.fetches == 1
+    assert store.etag == '"v1"'
+    assert store.snapshot.mapping is not None
+    assert isinstance(store.snapshot.rows, ColumnarRows)
+
+    # The next cold start revalidates with the saved ETag instead of downloading
+    store = asyncio.run(run())
+    assert sent == [None, '"v1"']
+    assert store.etag == '"v1"'
+    assert store.snapshot.source == "local"
+
+def test_start_does_not_wait_for_slow_upstream():
+    import asyncio
+    import httpx
+    import dataset
+
+    async def run():
+        async def handler(request):
+            await asyncio.sleep(30)
+            return httpx.Response(304)
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        store = dataset.DatasetStore("http://example.invalid/data.csv", main.DATA_PATH, client=client)
+        await asyncio.wait_for(store.start(), timeout=5)
+        assert store.snapshot.source == "local"
+        assert store.info()["refreshing"]
+        await store.stop()
+
+    asyncio.run(run())